@@ -0,0 +1,240 @@
+"""
+Copyright © 2023, United States Government, as represented by the Administrator
+of the National Aeronautics and Space Administration. All rights reserved.
+
+The PySA, a powerful tool for solving optimization problems is licensed under
+the Apache License, Version 2.0 (the "License"); you may not use this file
+except in compliance with the License. You may obtain a copy of the License at
+http://www.apache.org/licenses/LICENSE-2.0.
+
+Unless required by applicable law or agreed to in writing, software distributed
+under the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+CONDITIONS OF ANY KIND, either express or implied. See the License for the
+specific language governing permissions and limitations under the License.
+"""
+
+from itertools import product
+import json
+import os
+import subprocess
+import sys
+import numpy as np
+import pytest
+
+torch = pytest.importorskip('torch')
+
+tests = os.path.dirname(os.path.abspath(__file__))
+tutorials = os.path.join(tests, '..', 'tutorials')
+sys.path.insert(0, tutorials)
+import rbm_pysa
+
+# Size of the RBM
+visible_dim = 4
+hidden_dim = 2
+
+# Number of replicas, and number of sweeps discarded / collected per replica
+n_replicas = 32
+n_burn_in = 50
+n_samples = 400
+
+# Number of replicas and of sweeps collected with a temperature ladder
+n_replicas_ladder = 8
+n_samples_ladder = 4000
+
+# Same for the (much slower) CUDA simulator
+n_replicas_cudasim = 16
+n_burn_in_cudasim = 20
+n_samples_cudasim = 100
+
+# Tolerance on the total variation distance from the exact distribution
+max_tv = 0.1
+
+
+def gen_random_rbm(seed: int = 0):
+
+    # Generate random weights and biases
+    rng = np.random.default_rng(seed)
+    W = rng.normal(size=(visible_dim, hidden_dim)).astype('float32')
+    v_bias = rng.normal(size=visible_dim).astype('float32')
+    h_bias = rng.normal(size=hidden_dim).astype('float32')
+
+    return W, v_bias, h_bias
+
+
+def get_exact_distribution(W, v_bias, h_bias):
+
+    # Enumerate all the joint states, with the first unit as the highest bit
+    states = np.array(list(product([0, 1], repeat=visible_dim + hidden_dim)),
+                      dtype='float64')
+    v, h = states[:, :visible_dim], states[:, visible_dim:]
+
+    # Boltzmann distribution at beta = 1
+    energies = -(v @ v_bias + h @ h_bias + np.sum((v @ W) * h, axis=1))
+    p = np.exp(-(energies - energies.min()))
+
+    return p / p.sum()
+
+
+def get_empirical_distribution(samples):
+
+    # Map each joint state to its index in the enumeration
+    samples = np.round(np.asarray(samples, dtype='float64')).astype(int)
+    index = samples @ (2**np.arange(samples.shape[-1])[::-1])
+
+    n_states = 2**(visible_dim + hidden_dim)
+    return np.bincount(index.ravel(), minlength=n_states) / index.size
+
+
+def sample_rbm(sampler: str,
+               n_replicas: int = n_replicas,
+               n_samples: int = n_samples,
+               max_temp: float = 1.0,
+               **kwargs):
+
+    # Build the RBM with the coldest replica at beta = 1
+    rbm = rbm_pysa.RBM_PySA(visible_dim=visible_dim,
+                            hidden_dim=hidden_dim,
+                            state_size=n_replicas,
+                            steps=1,
+                            device='cpu',
+                            sampler=sampler,
+                            min_temp=1.0,
+                            max_temp=max_temp,
+                            **kwargs)
+    with torch.no_grad():
+        for param, value in zip((rbm.W, rbm.v_bias, rbm.h_bias),
+                                gen_random_rbm()):
+            param.copy_(torch.from_numpy(value))
+
+    # Collect the persistent states after each update
+    samples = []
+    for sweep in range(n_burn_in + n_samples):
+        rbm.update_states_with_pysa()
+        if sweep >= n_burn_in:
+            samples.append(rbm.state.numpy().copy())
+
+    return np.stack(samples)
+
+
+def sample_pt_kernel(n_replicas: int, n_sweeps: int, n_threads: int = 4):
+
+    from numba import cuda
+
+    # Copy the RBM to the (simulated) device
+    W, v_bias, h_bias = gen_random_rbm()
+    betas = np.ones(n_replicas, dtype='float32')
+    state = np.random.default_rng(1).integers(
+        2, size=(n_replicas, visible_dim + hidden_dim)).astype('float32')
+    args = [
+        cuda.to_device(x)
+        for x in (W, np.ascontiguousarray(W.T), v_bias, h_bias, state, betas)
+    ]
+    energies = np.zeros(n_replicas, dtype='float32')
+    rng_states = rbm_pysa.create_xoroshiro128p_states(n_replicas * n_threads,
+                                                      seed=1)
+    shared_bytes = 4 * (visible_dim + hidden_dim)
+
+    # Sweep and exchange replicas as `RBM_PySA._update_states_numba_cuda` does,
+    # which needs CUDA tensors and cannot run under the simulator
+    samples = []
+    for sweep in range(n_burn_in_cudasim + n_sweeps):
+        d_energies = cuda.to_device(np.zeros_like(energies))
+        rbm_pysa.pt_kernel[n_replicas, n_threads, 0,
+                           shared_bytes](*args, d_energies, rng_states)
+        state = args[4].copy_to_host()
+        perm = rbm_pysa.replica_exchange(
+            torch.from_numpy(d_energies.copy_to_host()),
+            torch.from_numpy(betas), sweep % 2)
+        args[4] = cuda.to_device(np.ascontiguousarray(state[perm.numpy()]))
+        if sweep >= n_burn_in_cudasim:
+            samples.append(state)
+
+    return np.stack(samples)
+
+
+@pytest.mark.parametrize('sampler,kwargs', [('pysa', {}), ('torch', {}),
+                                            ('numba', {}),
+                                            ('numba', {
+                                                'parallel': False
+                                            })])
+def test_sampler_distribution(sampler: str, kwargs: dict):
+
+    # Get exact and sampled distributions
+    p_exact = get_exact_distribution(*gen_random_rbm())
+    p_sampled = get_empirical_distribution(sample_rbm(sampler, **kwargs))
+
+    # Check total variation distance
+    assert (0.5 * np.abs(p_exact - p_sampled).sum() < max_tv)
+
+
+@pytest.mark.parametrize('sampler', ['torch', 'numba'])
+def test_sampler_ladder_distribution(sampler: str):
+
+    # Get exact and sampled distributions of the beta = 1 replica
+    p_exact = get_exact_distribution(*gen_random_rbm())
+    samples = sample_rbm(sampler,
+                         n_replicas=n_replicas_ladder,
+                         n_samples=n_samples_ladder,
+                         max_temp=3.5)
+    p_sampled = get_empirical_distribution(samples[:, 0])
+
+    # Check total variation distance
+    assert (0.5 * np.abs(p_exact - p_sampled).sum() < max_tv)
+
+
+def test_replica_exchange_parity(monkeypatch):
+
+    # Record the parities of the replica exchanges
+    parities = []
+
+    def replica_exchange(energies, betas, parity):
+        parities.append(parity)
+        return torch.arange(len(betas))
+
+    monkeypatch.setattr(rbm_pysa, 'replica_exchange', replica_exchange)
+
+    # Both even and odd pairs must be exchanged, even with one sweep per call
+    rbm = rbm_pysa.RBM_PySA(visible_dim=visible_dim,
+                            hidden_dim=hidden_dim,
+                            state_size=n_replicas_ladder,
+                            steps=1,
+                            device='cpu',
+                            sampler='torch')
+    for _ in range(4):
+        rbm.update_states_with_pysa()
+    assert (parities == [0, 1, 0, 1])
+
+
+def test_pt_kernel_distribution():
+
+    # The CUDA simulator must be enabled before numba.cuda is imported
+    script = ('import json, sys; sys.path.insert(0, sys.argv[1]); '
+              'import tests_rbm_pysa as t; '
+              'samples = t.sample_pt_kernel(t.n_replicas_cudasim, '
+              't.n_samples_cudasim); '
+              'print(json.dumps(samples.tolist()))')
+    args = [sys.executable, '-c', script, tests]
+    env = dict(os.environ, NUMBA_ENABLE_CUDASIM='1')
+    output = subprocess.run(args,
+                            env=env,
+                            cwd=os.path.join(tests, '..'),
+                            capture_output=True,
+                            text=True,
+                            check=True).stdout
+
+    # Get exact and sampled distributions
+    p_exact = get_exact_distribution(*gen_random_rbm())
+    p_sampled = get_empirical_distribution(json.loads(output))
+
+    # Check total variation distance
+    assert (0.5 * np.abs(p_exact - p_sampled).sum() < max_tv)
+
+
+def test_numba_cuda_requires_cuda():
+
+    # The CUDA kernel sampler cannot run on a CPU model
+    with pytest.raises(ValueError):
+        rbm_pysa.RBM_PySA(visible_dim=visible_dim,
+                          hidden_dim=hidden_dim,
+                          device='cpu',
+                          sampler='numba_cuda')
@@ -13,11 +13,232 @@ CONDITIONS OF ANY KIND, either express or implied. See the License for the
 specific language governing permissions and limitations under the License.
 """
 
+import math
 import torch
+import numba
 import numpy as np
+from numba import cuda
+from numba.cuda.random import create_xoroshiro128p_states, xoroshiro128p_uniform_float32
 from pysa.sa import Solver
 
-td = torch.distributions
+# Number of threads per replica used by `pt_kernel`
+PT_KERNEL_THREADS = 128
+
+
+@numba.njit(fastmath=True, nogil=True, parallel=True)
+def pt_sweep_numba(W, v_bias, h_bias, state, betas, num_sweeps):
+    """
+    Performs parallel tempering with sequential Metropolis sweeps on CPU, updating `state` in place.
+
+    Replicas are swept in parallel. The local fields of the visible and hidden units are maintained incrementally, so
+    that each accepted flip costs O(hidden_dim) or O(visible_dim). Replica `k` is kept at inverse temperature
+    `betas[k]` by exchanging states between adjacent replicas after each sweep, in the same order as PySA.
+
+    Parameters:
+        W (np.ndarray): An array of shape (visible_dim, hidden_dim) with the weights of the RBM.
+        v_bias (np.ndarray): An array of shape (visible_dim,) with the visible biases.
+        h_bias (np.ndarray): An array of shape (hidden_dim,) with the hidden biases.
+        state (np.ndarray): An array of shape (num_replicas, visible_dim + hidden_dim) with the joint states.
+        betas (np.ndarray): An array of shape (num_replicas,) with the inverse temperatures of the replicas.
+        num_sweeps (int): The number of sweeps to perform.
+    """
+
+    # Get number of replicas
+    n_replicas = state.shape[0]
+    visible_dim, hidden_dim = W.shape
+    Wt = np.ascontiguousarray(W.T)
+
+    # Get local fields (laid out as the joint state) and energies
+    v_state = np.ascontiguousarray(state[:, :visible_dim])
+    h_state = np.ascontiguousarray(state[:, visible_dim:])
+    field = np.empty_like(state)
+    field[:, :visible_dim] = np.dot(h_state, Wt) + v_bias
+    field[:, visible_dim:] = np.dot(v_state, W) + h_bias
+    energies = -(np.dot(v_state, v_bias) +
+                 np.sum(h_state * field[:, visible_dim:], axis=1))
+
+    for s in range(num_sweeps):
+
+        # Sweep each replica, first over the visible and then the hidden units
+        for k in numba.prange(n_replicas):
+            for i in range(visible_dim):
+                delta_n_energy = (1. - 2. * state[k, i]) * field[k, i]
+                if delta_n_energy >= 0 or np.log(
+                        np.random.random()) < betas[k] * delta_n_energy:
+                    field[k, visible_dim:] += (1. - 2. * state[k, i]) * W[i]
+                    state[k, i] = 1. - state[k, i]
+                    energies[k] -= delta_n_energy
+
+            for i in range(visible_dim, visible_dim + hidden_dim):
+                delta_n_energy = (1. - 2. * state[k, i]) * field[k, i]
+                if delta_n_energy >= 0 or np.log(
+                        np.random.random()) < betas[k] * delta_n_energy:
+                    field[k, :visible_dim] += (
+                        1. - 2. * state[k, i]) * Wt[i - visible_dim]
+                    state[k, i] = 1. - state[k, i]
+                    energies[k] -= delta_n_energy
+
+        # Parallel tempering move
+        for k in range(n_replicas - 1):
+            k1 = n_replicas - k - 1
+            k2 = n_replicas - k - 2
+            de = (energies[k1] - energies[k2]) * (betas[k1] - betas[k2])
+            if de >= 0 or np.random.random() < np.exp(de):
+                for x in (state, field):
+                    tmp = np.copy(x[k1])
+                    x[k1] = x[k2]
+                    x[k2] = tmp
+                energies[k1], energies[k2] = energies[k2], energies[k1]
+
+
+# Same sweep with the replicas swept one after the other (`prange` falls back to `range`)
+pt_sweep_numba_sequential = numba.njit(fastmath=True,
+                                       nogil=True,
+                                       parallel=False)(pt_sweep_numba.py_func)
+
+
+@cuda.jit
+def pt_kernel(W, Wt, v_bias, h_bias, state, betas, energies, rng_states):
+    """
+    Performs one sequential Metropolis sweep per replica on a CUDA device, updating `state` in place.
+
+    Each block sweeps one replica, whose state is kept in (dynamic) shared memory of size visible_dim + hidden_dim,
+    and its threads update the units of one layer concurrently, which is equivalent to a sequential sweep since units
+    of one layer do not interact. The energies of the updated replicas are accumulated into `energies`, which must be
+    zeroed before the launch.
+
+    Parameters:
+        W (DeviceNDArray): An array of shape (visible_dim, hidden_dim) with the weights of the RBM.
+        Wt (DeviceNDArray): A contiguous array of shape (hidden_dim, visible_dim) with the transpose of `W`.
+        v_bias (DeviceNDArray): An array of shape (visible_dim,) with the visible biases.
+        h_bias (DeviceNDArray): An array of shape (hidden_dim,) with the hidden biases.
+        state (DeviceNDArray): An array of shape (num_replicas, visible_dim + hidden_dim) with the joint states.
+        betas (DeviceNDArray): An array of shape (num_replicas,) with the inverse temperatures of the replicas.
+        energies (DeviceNDArray): An array of shape (num_replicas,) receiving the energies of the replicas.
+        rng_states (DeviceNDArray): The xoroshiro128p states, one per thread of the grid.
+    """
+
+    # Get replica and thread
+    k = cuda.blockIdx.x
+    tid = cuda.threadIdx.x
+    n_threads = cuda.blockDim.x
+    rng = k * n_threads + tid
+    visible_dim, hidden_dim = W.shape
+
+    # Load state in shared memory
+    s = cuda.shared.array(0, dtype=numba.float32)
+    for i in range(tid, visible_dim + hidden_dim, n_threads):
+        s[i] = state[k, i]
+    cuda.syncthreads()
+
+    # Metropolis update of the visible units given the hidden units
+    energy = 0.
+    for i in range(tid, visible_dim, n_threads):
+        field = v_bias[i]
+        for j in range(hidden_dim):
+            field += Wt[j, i] * s[visible_dim + j]
+        delta_n_energy = (1. - 2. * s[i]) * field
+        if delta_n_energy >= 0 or math.log(1. - xoroshiro128p_uniform_float32(
+                rng_states, rng)) < betas[k] * delta_n_energy:
+            s[i] = 1. - s[i]
+        energy -= s[i] * v_bias[i]
+    cuda.syncthreads()
+
+    # Metropolis update of the hidden units given the visible units
+    for j in range(tid, hidden_dim, n_threads):
+        field = h_bias[j]
+        for i in range(visible_dim):
+            field += W[i, j] * s[i]
+        delta_n_energy = (1. - 2. * s[visible_dim + j]) * field
+        if delta_n_energy >= 0 or math.log(1. - xoroshiro128p_uniform_float32(
+                rng_states, rng)) < betas[k] * delta_n_energy:
+            s[visible_dim + j] = 1. - s[visible_dim + j]
+        energy -= s[visible_dim + j] * field
+    cuda.atomic.add(energies, k, numba.float32(energy))
+    cuda.syncthreads()
+
+    # Store state
+    for i in range(tid, visible_dim + hidden_dim, n_threads):
+        state[k, i] = s[i]
+
+
+def replica_exchange(energies, betas, parity):
+    """
+    Attempts to exchange the states of adjacent replicas, using either the even (`parity=0`) or odd (`parity=1`) pairs.
+
+    Parameters:
+        energies (torch.Tensor): A tensor of shape (num_replicas,) with the energies of the replicas.
+        betas (torch.Tensor): A tensor of shape (num_replicas,) with the inverse temperatures of the replicas.
+        parity (int): The parity of the first replica of each pair.
+
+    Returns:
+        torch.Tensor: The permutation of the replicas to apply to their states.
+    """
+    k = torch.arange(parity, len(betas) - 1, 2, device=betas.device)
+    de = (energies[k + 1] - energies[k]) * (betas[k + 1] - betas[k])
+    swap = k[torch.rand_like(de).log() < de]
+    perm = torch.arange(len(betas), device=betas.device)
+    perm[swap], perm[swap + 1] = swap + 1, swap
+    return perm
+
+
+@torch.no_grad()
+def pt_metropolis(W,
+                  Wt,
+                  v_bias,
+                  h_bias,
+                  v_state,
+                  h_state,
+                  betas,
+                  num_sweeps,
+                  parity=0):
+    """
+    Performs parallel tempering with Metropolis updates on the device holding the RBM parameters.
+
+    Units of one layer do not interact with each other, so a sequential Metropolis sweep over the visible units
+    followed by the hidden units is equivalent to two block updates, one per layer. Replica `k` is kept at inverse
+    temperature `betas[k]` and, after each sweep, adjacent replicas attempt to exchange their states (alternating
+    between even and odd pairs, starting from `parity`).
+
+    Parameters:
+        W (torch.Tensor): A tensor of shape (visible_dim, hidden_dim) with the weights of the RBM.
+        Wt (torch.Tensor): A contiguous tensor of shape (hidden_dim, visible_dim) with the transpose of `W`.
+        v_bias (torch.Tensor): A tensor of shape (visible_dim,) with the visible biases.
+        h_bias (torch.Tensor): A tensor of shape (hidden_dim,) with the hidden biases.
+        v_state (torch.Tensor): A tensor of shape (num_replicas, visible_dim) with the initial visible states.
+        h_state (torch.Tensor): A tensor of shape (num_replicas, hidden_dim) with the initial hidden states.
+        betas (torch.Tensor): A tensor of shape (num_replicas,) with the inverse temperatures of the replicas.
+        num_sweeps (int): The number of sweeps to perform.
+        parity (int, Optional): The parity of the pairs exchanged after the first sweep. Callers that perform few sweeps
+            per call must alternate it across calls, otherwise the odd pairs never exchange. Defaults to 0.
+
+    Returns:
+        tuple: The updated visible and hidden states.
+    """
+    # Acceptance tests need more precision than reduced-precision states provide
+    dtype = v_state.dtype
+    v_state, h_state = v_state.to(W.dtype), h_state.to(W.dtype)
+
+    beta = betas.unsqueeze(-1)
+
+    for sweep in range(num_sweeps):
+        # Metropolis update of the visible units given the hidden units
+        delta = (1 - 2 * v_state) * (h_state @ Wt + v_bias)
+        accept = torch.rand_like(v_state).log() < beta * delta
+        v_state = torch.where(accept, 1 - v_state, v_state)
+
+        # Metropolis update of the hidden units given the visible units
+        delta = (1 - 2 * h_state) * (v_state @ W + h_bias)
+        accept = torch.rand_like(h_state).log() < beta * delta
+        h_state = torch.where(accept, 1 - h_state, h_state)
+
+        # Parallel tempering move between adjacent replicas
+        energy = -(v_state @ v_bias + h_state @ h_bias +
+                   torch.sum(v_state @ W * h_state, dim=1))
+        perm = replica_exchange(energy, betas, (parity + sweep) % 2)
+        v_state, h_state = v_state[perm], h_state[perm]
+
+    return v_state.to(dtype), h_state.to(dtype)
 
 
 class RBM_PySA(torch.nn.Module):
@@ -30,14 +251,28 @@ class RBM_PySA(torch.nn.Module):
         state_size (int): The number of samples used to approximate the negative phase.
         steps (int): The number of Gibbs sampling steps to perform in the negative phase.
         device (str, Optional): The device to run the RBM on, either 'cpu' or 'cuda'. Defaults to 'cuda' if available, else 'cpu'.
-        **kwargs (dict, Optional): An optional keyword arguments for PySA settings.
+        **kwargs (dict, Optional): An optional keyword arguments for PySA settings. The `sampler` keyword selects the
+            negative phase sampler: 'pysa', 'torch' (`pt_metropolis` with torch ops on the RBM device), 'numba'
+            (`pt_sweep_numba` on CPU, sweeping the replicas in parallel unless `parallel=False`), 'numba_cuda'
+            (`pt_kernel` on the CUDA device, which runs in float32 on a float32 copy of reduced-precision states), or
+            'auto' (default) for 'torch' when the RBM runs on a CUDA device and 'numba' otherwise. The `dtype` keyword
+            sets the precision of the states and of the autocast region used by `v2h`, `h2v` and `_energy` (defaults to
+            torch.bfloat16 on CUDA devices that support it, torch.float32 otherwise). Setting `compile=True` compiles
+            `_energy`, `v2h` and `_h2v` with `torch.compile`, specialized to fixed shapes (defaults to False). They are
+            warmed up on the persistent states and, if the `batch_size` keyword is given, on a batch of training data
+            (other batch sizes, e.g. a smaller last batch, trigger a recompilation on first use).
     
     Attributes:
         W (torch.nn.Parameter): A matrix representing the weights between visible and hidden units.
+        Wt_cached (torch.Tensor): A contiguous copy of the transpose of `W`, refreshed by the 'torch' and 'numba_cuda'
+            samplers and after in-place updates of `W` (writes through `W.data` are only picked up by the next refresh).
         v_bias (torch.nn.Parameter): A vector representing the biases for the visible units.
         h_bias (torch.nn.Parameter): A vector representing the biases for the hidden units.
-        v_state (torch.autograd.Variable): A matrix representing the visible state of the RBM.
-        h_state (torch.autograd.Variable): A matrix representing the hidden state of the RBM.
+        state (torch.Tensor): A buffer representing the joint visible and hidden state of the RBM (saved in the state dict).
+        v_state (torch.Tensor): A view of `state` representing the visible state of the RBM.
+        h_state (torch.Tensor): A view of `state` representing the hidden state of the RBM.
+        problem (torch.Tensor): The augmented QUBO matrix passed to PySA, kept in (pinned) host memory allocated on first
+            use and filled by `build_problem`.
     """
 
     def __init__(self,
@@ -60,25 +295,114 @@ class RBM_PySA(torch.nn.Module):
         self.float_type = 'float32'
 
         if device is None:
-            self.device = "cuda" if torch.cuda.is_available() else "cpu"
+            device = "cuda" if torch.cuda.is_available() else "cpu"
+        device = torch.device(device)
+
+        if 'dtype' in kwargs:
+            self.dtype = kwargs['dtype']
+        elif device.type == 'cuda' and torch.cuda.is_bf16_supported():
+            self.dtype = torch.bfloat16
         else:
-            self.device = device
+            self.dtype = torch.float32
+
+        self.sampler = kwargs['sampler'] if 'sampler' in kwargs else 'auto'
+        if self.sampler == 'auto':
+            self.sampler = 'torch' if device.type == 'cuda' else 'numba'
+        if self.sampler not in ('pysa', 'torch', 'numba', 'numba_cuda'):
+            raise ValueError(f"sampler='{self.sampler}' not recognized.")
+        if self.sampler == 'numba_cuda' and device.type != 'cuda':
+            raise ValueError(f"sampler='numba_cuda' requires a CUDA device.")
+
+        # Inverse temperatures of the replicas, as chosen by PySA
+        self.register_buffer('betas',
+                             1 / torch.logspace(np.log10(self.min_temp),
+                                                np.log10(self.max_temp),
+                                                self.state_size,
+                                                device=device),
+                             persistent=False)
 
         self.W = torch.nn.Parameter(
-            torch.randn(self.visible_dim, self.hidden_dim, device=self.device))
+            torch.randn(self.visible_dim, self.hidden_dim, device=device))
         self.v_bias = torch.nn.Parameter(
-            torch.zeros(self.visible_dim, 1, device=self.device))
+            torch.zeros(self.visible_dim, device=device))
         self.h_bias = torch.nn.Parameter(
-            torch.zeros(self.hidden_dim, 1, device=self.device))
-
-        self.v_state = torch.autograd.Variable(torch.zeros(self.state_size,
-                                                           self.visible_dim,
-                                                           device=self.device),
-                                               requires_grad=False)
-        self.h_state = torch.autograd.Variable(torch.zeros(self.state_size,
-                                                           self.hidden_dim,
-                                                           device=self.device),
-                                               requires_grad=False)
+            torch.zeros(self.hidden_dim, device=device))
+        # Contiguous copy of W.t() for `h2v` and the samplers, see `_Wt`
+        self.register_buffer('Wt_cached',
+                             self.W.detach().t().contiguous(),
+                             persistent=False)
+        self._Wt_version = self.W._version
+
+        self.register_buffer(
+            'state',
+            torch.zeros(self.state_size,
+                        self.visible_dim + self.hidden_dim,
+                        dtype=self.dtype,
+                        device=device))
+        # Random number generator states of `pt_kernel`, created on first use on `rng_device`
+        self.rng_states = None
+        self.rng_device = None
+        # Parity of the next replica exchange of `pt_metropolis` and `pt_kernel`, alternated across calls
+        self._pt_parity = 0
+
+        # Host buffers shared with PySA, allocated on first use by `_alloc_host_buffers`
+        self.problem = None
+        self.init_state = None
+        self.neg_problem = None
+
+        # Specialize the hot methods to the (fixed) model shapes
+        self.use_compile = kwargs['compile'] if 'compile' in kwargs else False
+        self.batch_size = kwargs[
+            'batch_size'] if 'batch_size' in kwargs else None
+        if self.use_compile:
+            for name in ('_energy', 'v2h', '_h2v'):
+                setattr(
+                    self, name,
+                    torch.compile(getattr(self, name),
+                                  dynamic=False,
+                                  fullgraph=True))
+
+            # Warm-up on the persistent states and a training batch to trigger compilation
+            self._energy(self.v_state, self.h_state)
+            self.h2v(self.v2h(self.v_state))
+            if self.batch_size is not None:
+                v = torch.zeros(self.batch_size,
+                                self.visible_dim,
+                                device=device)
+                self.log_prob(v)
+                self.forward(v)
+
+    @property
+    def device(self):
+        """torch.device: The device holding the RBM parameters and buffers, following `Module.to`."""
+        return self.W.device
+
+    @property
+    def v_state(self):
+        """torch.Tensor: The visible units of the persistent states, as a view of `self.state`."""
+        return self.state.narrow(1, 0, self.visible_dim)
+
+    @property
+    def h_state(self):
+        """torch.Tensor: The hidden units of the persistent states, as a view of `self.state`."""
+        return self.state.narrow(1, self.visible_dim, self.hidden_dim)
+
+    def _autocast(self):
+        """Returns the autocast context running the RBM math in `self.dtype` with float32 parameters."""
+        return torch.autocast(device_type=self.device.type,
+                              dtype=self.dtype,
+                              enabled=self.dtype != torch.float32)
+
+    def _Wt(self, refresh=False):
+        """
+        Returns `Wt_cached`, copying `W.t()` into it first if `refresh` is True or if `W` has been modified in-place
+        (e.g. by an optimizer). Writes through `W.data` do not bump the version counter of `W`, so they are only seen
+        when `refresh` is True.
+        """
+        if refresh or self._Wt_version != self.W._version:
+            self.Wt_cached.copy_(self.W.detach().t())
+            self._Wt_version = self.W._version
+        return self.Wt_cached
 
     def v2h(self, v):
         """
@@ -90,9 +414,25 @@ class RBM_PySA(torch.nn.Module):
         Returns:
             torch.Tensor: A tensor of shape (batch_size, hidden_dim).
         """
-        hidden_logits = torch.nn.functional.linear(v, self.W.t(),
-                                                   self.h_bias.t())
-        return td.Bernoulli(logits=hidden_logits).sample()
+        return torch.bernoulli(self.v2h_probs(v))
+
+    def v2h_probs(self, v, vW=None):
+        """
+        Returns the probabilities of the hidden units of the RBM being active given the visible units.
+
+        Parameters:
+            v (torch.Tensor): A tensor of shape (batch_size, visible_dim).
+            vW (torch.Tensor, Optional): The product `v @ W`, if already computed by the caller.
+
+        Returns:
+            torch.Tensor: A tensor of shape (batch_size, hidden_dim).
+        """
+        with torch.no_grad(), self._autocast():
+            if vW is None:
+                hidden_logits = torch.addmm(self.h_bias, v, self.W)
+            else:
+                hidden_logits = vW + self.h_bias
+            return torch.sigmoid_(hidden_logits)
 
     def h2v(self, h):
         """
@@ -104,54 +444,162 @@ class RBM_PySA(torch.nn.Module):
         Returns:
             torch.Tensor: A tensor of shape (batch_size, visible_dim).
         """
+        return self._h2v(h, self._Wt())
 
-        visible_logits = torch.nn.functional.linear(h, self.W, self.v_bias.t())
-        return td.Bernoulli(logits=visible_logits).sample()
+    def _h2v(self, h, Wt):
+        """Samples the visible units given the hidden units `h` and the (contiguous) transpose `Wt` of the weights."""
+        with torch.no_grad(), self._autocast():
+            visible_logits = torch.addmm(self.v_bias, h, Wt)
+            return torch.bernoulli(torch.sigmoid_(visible_logits))
 
     def update_states_with_pysa(self):
         """Updates the state of the RBM by performing multiple steps of Parallel tempering sampling."""
-        self.problem = torch.zeros(self.visible_dim + self.hidden_dim,
-                                   self.visible_dim + self.hidden_dim)
-        # Augment Problem
-        self.problem[:self.visible_dim, self.visible_dim:] = self.W
-        self.problem[self.visible_dim:, :self.visible_dim] = self.W.t()
-        self.problem += torch.diag(
-            torch.cat([self.v_bias, self.h_bias], dim=0).squeeze()).cpu()
-
-        solver = Solver(problem=-self.problem.detach().numpy(),
+        # The samplers reading `Wt_cached` refresh it once per step, to also catch writes through `W.data`
+        if self.sampler == 'torch':
+            v_state, h_state = pt_metropolis(self.W.detach(),
+                                             self._Wt(refresh=True),
+                                             self.v_bias, self.h_bias,
+                                             self.v_state, self.h_state,
+                                             self.betas, self.steps,
+                                             self._pt_parity)
+            self.v_state.copy_(v_state)
+            self.h_state.copy_(h_state)
+            self._pt_parity = (self._pt_parity + self.steps) % 2
+        elif self.sampler == 'numba':
+            self._update_states_numba()
+        elif self.sampler == 'numba_cuda':
+            self._update_states_numba_cuda()
+        else:
+            self._update_states_pysa()
+
+    def _update_states_numba(self):
+        """Updates the state of the RBM by calling `pt_sweep_numba` on host copies of the parameters and states."""
+
+        def to_numpy(x):
+            return np.ascontiguousarray(x.detach().cpu().float().numpy())
+
+        pt_sweep = pt_sweep_numba if self.parallel else pt_sweep_numba_sequential
+        state = to_numpy(self.state)
+        pt_sweep(to_numpy(self.W), to_numpy(self.v_bias), to_numpy(self.h_bias),
+                 state, to_numpy(self.betas), self.steps)
+        self.state.copy_(torch.from_numpy(state))
+
+    def _update_states_numba_cuda(self):
+        """Updates the state of the RBM by launching `pt_kernel` on the device buffers, without host transfers."""
+        stream = cuda.external_stream(torch.cuda.current_stream().cuda_stream)
+        # The states live on one device, so they are recreated after `Module.to` moves the RBM
+        if self.rng_states is None or self.rng_device != self.device:
+            self.rng_states = create_xoroshiro128p_states(
+                self.state_size * PT_KERNEL_THREADS,
+                seed=torch.randint(2**31, ()).item(),
+                stream=stream)
+            self.rng_device = self.device
+
+        # Numba has no bfloat16, so reduced-precision states are swept in a float32 copy
+        state = self.state.float()
+        energies = torch.empty(self.state_size, device=self.device)
+        args = [
+            cuda.as_cuda_array(x)
+            for x in (self.W.detach(), self._Wt(refresh=True),
+                      self.v_bias.detach(), self.h_bias.detach(), state,
+                      self.betas, energies)
+        ]
+        shared_bytes = 4 * (self.visible_dim + self.hidden_dim)
+
+        for sweep in range(self.steps):
+            energies.zero_()
+            pt_kernel[self.state_size, PT_KERNEL_THREADS, stream,
+                      shared_bytes](*args, self.rng_states)
+            state.copy_(state[replica_exchange(energies, self.betas,
+                                               self._pt_parity)])
+            self._pt_parity = 1 - self._pt_parity
+        self.state.copy_(state)
+
+    def _alloc_host_buffers(self):
+        """Allocates the host buffers shared with PySA, page-locked if the RBM runs on a CUDA device."""
+        if self.problem is not None:
+            return
+
+        pin_memory = self.device.type == 'cuda'
+        self.problem = torch.empty(self.visible_dim + self.hidden_dim,
+                                   self.visible_dim + self.hidden_dim,
+                                   pin_memory=pin_memory)
+        # Only the W blocks and the diagonal are written at each step, so the
+        # (visible, visible) and (hidden, hidden) blocks are zeroed once here
+        self.problem[:self.visible_dim, :self.visible_dim].zero_()
+        self.problem[self.visible_dim:, self.visible_dim:].zero_()
+        self.init_state = torch.empty(self.state_size,
+                                      self.visible_dim + self.hidden_dim,
+                                      pin_memory=pin_memory)
+        # Host-only buffer receiving the negated problem handed to PySA
+        self.neg_problem = torch.empty_like(self.problem)
+
+    def build_problem(self):
+        """
+        Writes the current weights and biases into the augmented QUBO matrix used by PySA.
+
+        Returns:
+            torch.Tensor: `self.problem`, a host tensor of shape (visible_dim + hidden_dim, visible_dim + hidden_dim).
+        """
+        self._alloc_host_buffers()
+        W = self.W.detach()
+        V = self.visible_dim
+
+        # Augment Problem in place
+        self.problem[:V, V:].copy_(W, non_blocking=True)
+        self.problem[V:, :V].copy_(W.t(), non_blocking=True)
+        diagonal = self.problem.diagonal()
+        diagonal[:V].copy_(self.v_bias.detach(), non_blocking=True)
+        diagonal[V:].copy_(self.h_bias.detach(), non_blocking=True)
+
+        # Wait for the device-to-host copies before the host reads the buffers
+        if self.device.type == 'cuda':
+            torch.cuda.current_stream().synchronize()
+        return self.problem
+
+    def _update_states_pysa(self):
+        """Updates the state of the RBM by calling PySA on the augmented QUBO problem."""
+        # Queued before `build_problem`, whose synchronization also covers this copy
+        self._alloc_host_buffers()
+        self.init_state.copy_(self.state, non_blocking=True)
+        self.build_problem()
+
+        torch.neg(self.problem, out=self.neg_problem)
+        solver = Solver(problem=self.neg_problem.numpy(),
                         problem_type='qubo',
                         float_type='float32')
 
-        results = solver.metropolis_update(num_sweeps=self.steps,
-                                           num_reads=1,
-                                           num_replicas=self.state_size,
-                                           update_strategy='sequential',
-                                           min_temp=self.min_temp,
-                                           max_temp=self.max_temp,
-                                           initialize_strategy=torch.cat(
-                                               [self.v_state, self.h_state],
-                                               dim=1).cpu().detach().numpy(),
-                                           parallel=self.parallel,
-                                           verbose=False)
-
-        states = torch.tensor(results['states'].values[0]).to(self.device)
-        self.v_state, self.h_state = torch.split(states,
-                                                 self.visible_dim,
-                                                 dim=1)
-
-    def _energy(self, v, h):
+        results = solver.metropolis_update(
+            num_sweeps=self.steps,
+            num_reads=1,
+            num_replicas=self.state_size,
+            update_strategy='sequential',
+            min_temp=self.min_temp,
+            max_temp=self.max_temp,
+            initialize_strategy=self.init_state.numpy(),
+            parallel=self.parallel,
+            verbose=False)
+
+        self.state.copy_(torch.from_numpy(results['states'].values[0]))
+
+    def _energy(self, v, h, vW=None):
         """
         Calculates the energy of a binary RBM given binary input `v` and hidden layer `h`.
 
         Parameters:
             v (torch.tensor): The tensor representing the visible units.
             h (torch.tensor): The tensor representing the hidden units.
+            vW (torch.tensor, Optional): The product `v @ W`, if already computed by the caller.
 
         Returns:
             torch.tensor: The energy configuration of a binary RBM given binary input `v` and hidden layer `h`.
         """
-        return -(torch.matmul(v, self.v_bias) + torch.matmul(h, self.h_bias) +
-                 torch.sum(torch.matmul(v, self.W) * h, dim=1, keepdim=True))
+        with self._autocast():
+            if vW is None:
+                vW = v @ self.W
+        # Only the GEMM runs in reduced precision, energies are accumulated in float32
+        v, h, vW = v.float(), h.float(), vW.float()
+        return -(v @ self.v_bias + h @ self.h_bias + torch.sum(vW * h, dim=-1))
 
     def energy(self, v):
         """
@@ -168,9 +616,24 @@ class RBM_PySA(torch.nn.Module):
         h = self.v2h(v)
         return self._energy(v, h)
 
+    def cd_step(self, v):
+        """
+        Performs one training step of persistent contrastive divergence: updates the persistent states with
+        `update_states_with_pysa` and evaluates both phases once.
+
+        Parameters:
+            v (torch.tensor): The tensor representing the visible units.
+
+        Returns:
+            torch.tensor: The loss to minimize, i.e. the negative log-probability summed over the samples in `v`.
+        """
+        self.update_states_with_pysa()
+        return -torch.sum(self.log_prob(v))
+
     def log_prob(self, v):
         """
-        Computes the log-probability of the joint probability of visible and hidden units.
+        Computes the log-probability of the joint probability of visible and hidden units. The products `v @ W` of both
+        phases are computed by a single GEMM on the samples in `v` stacked with the persistent visible states.
 
         Parameters:
             v (torch.tensor): The tensor representing the visible units.
@@ -178,32 +641,44 @@ class RBM_PySA(torch.nn.Module):
         Returns:
             torch.tensor: The log-probability of the joint probability of visible and hidden units.
         """
-        positive_phase = self.positive_phase(v)
-        negative_phase = self.negative_phase()
+        with self._autocast():
+            vW = torch.cat([v, self.v_state.to(v.dtype)]) @ self.W
+        vW_data, vW_state = vW.split([len(v), self.state_size])
+        positive_phase = self.positive_phase(v, vW_data)
+        negative_phase = self.negative_phase(vW_state)
         logpz = -(positive_phase - negative_phase)
         return logpz
 
-    def positive_phase(self, v):
+    def positive_phase(self, v, vW=None):
         """
-        Computes the positive phase of the contrastive divergence.
+        Computes the positive phase of the contrastive divergence. The energy is linear in the hidden units, so the
+        hidden samples are replaced by their expectation given `v`, which gives a lower-variance estimate. The same GEMM
+        `v @ W` provides both the hidden activations and the interaction energy.
 
         Parameters:
             v (torch.tensor): The tensor representing the visible units.
+            vW (torch.tensor, Optional): The product `v @ W`, if already computed by the caller.
 
         Returns:
-            torch.tensor: The mean positive phase of the contrastive divergence.
+            torch.tensor: The positive phase of the contrastive divergence for each sample in `v`.
         """
-        positive_phase = self.energy(v)
-        return torch.mean(positive_phase, dim=-1)
+        if vW is None:
+            with self._autocast():
+                vW = v @ self.W
+        h_prob = self.v2h_probs(v, vW)
+        return self._energy(v, h_prob, vW)
 
-    def negative_phase(self):
+    def negative_phase(self, vW=None):
         """
         Calculate the negative phase of the RBM
 
+        Parameters:
+            vW (torch.tensor, Optional): The product `v_state @ W`, if already computed by the caller.
+
         Returns:
             The mean of the energy calculated from the generated sample by the RBM
         """
-        negative_phase = self._energy(self.v_state, self.h_state)
+        negative_phase = self._energy(self.v_state, self.h_state, vW)
         return torch.mean(negative_phase)
 
     def forward(self, x):
@@ -217,4 +692,4 @@ class RBM_PySA(torch.nn.Module):
         Returns:
             reconstructed_x (torch.Tensor): The reconstructed version of `x` with the same shape as `x`
         """
-        return self.h2v(self.v2h(x))
+        return self.h2v(self.v2h(x)).to(x.dtype)